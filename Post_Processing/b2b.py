@@ -8,34 +8,61 @@ import numpy as np
 import nibabel as nib
 import argparse
 
+# Numba is optional; the NumPy broadcasting path below is the fallback
+try:
+    from numba import njit, prange
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
+
+if HAVE_NUMBA:
+    @njit(parallel=True, cache=True)
+    def _fill_mask(mask, curve_points, off_x, off_y, off_z):
+        """Scalar kernel stamping the precomputed offset table at each curve point."""
+        for k in prange(curve_points.shape[0]):
+            z = curve_points[k, 0]
+            y = curve_points[k, 1]
+            x = curve_points[k, 2]
+            for i in range(off_x.shape[0]):
+                zz = z + off_z[i]
+                yy = y + off_y[i]
+                xx = x + off_x[i]
+                if (0 <= zz < mask.shape[0] and 0 <= yy < mask.shape[1]
+                        and 0 <= xx < mask.shape[2]):
+                    mask[zz, yy, xx] = 1
+
+    # Warm up the JIT once at import so the first real call is not penalized
+    _fill_mask(np.zeros((1, 1, 1), dtype=np.uint8),
+               np.zeros((1, 3), dtype=np.int32),
+               np.zeros(1, dtype=np.int32),
+               np.zeros(1, dtype=np.int32),
+               np.zeros(1, dtype=np.int32))
 
-def bezier_curve(p0, p1, p2, n_points=50):
-    t = np.linspace(0, 1, n_points)[:, None]
-    curve = (1 - t) ** 2 * p0 + 2 * (1 - t) * t * p1 + t ** 2 * p2
-    return curve.astype(int)
 
-def create_curved_box_mask(shape, p1, p2,
-                           half_size_x=5, half_size_y=2, half_size_z=1,
-                           curve_strength=0, rotate_deg=0):
+def bezier_curve(p0, p1, p2, n_points=50):
+    t = np.linspace(0, 1, n_points)
+    mt = 1 - t
+    # Quadratic Bernstein basis as one (n,3) @ (3,3) matmul
+    basis = np.column_stack((mt * mt, 2 * mt * t, t * t))
+    curve = basis @ np.vstack((p0, p1, p2))
+    # Round to nearest voxel instead of truncating to avoid index jumps
+    return np.rint(curve).astype(np.int32)
+
+def _curved_box_local(shape, p1, p2,
+                      half_size_x=5, half_size_y=2, half_size_z=1,
+                      curve_strength=0, rotate_deg=0):
     """
-    Generate a flat rectangular cuboid rod with curvature and rotation in IJK index space.
-
-    :param shape: Volume shape (z, y, x)
-    :param p1, p2: IJK voxel coordinates (z, y, x)
-    :param half_size_x: Half-width along the x direction (voxels, longer horizontally)
-    :param half_size_y: Half-width along the y direction (voxels, flatter)
-    :param half_size_z: Half-width along the z direction (voxels, thickness)
-    :param curve_strength: Curvature strength; 0 = straight, >0 = curved inward, <0 = curved outward
-    :param rotate_deg: Rotation angle in the xy plane (degrees, positive = counterclockwise, negative = clockwise)
+    Build the curved box mask inside the bounding box of the curve only.
+    Returns (local_mask, slices) where slices locates the mask in the full
+    volume, so callers avoid allocating/scanning a full-volume array.
     """
-    mask = np.zeros(shape, dtype=np.uint8)
-
-    p1 = np.array(p1, dtype=int)
-    p2 = np.array(p2, dtype=int)
+    p1 = np.array(p1, dtype=np.int32)
+    p2 = np.array(p2, dtype=np.int32)
 
     if curve_strength == 0:
         num_points = int(np.linalg.norm(p2 - p1)) + 1
-        curve_points = np.linspace(p1, p2, num_points).astype(int)
+        curve_points = np.linspace(p1, p2, num_points).astype(np.int32)
     else:
         mid = (p1 + p2) / 2
         offset = np.array([0, curve_strength, 0])  # y 方向偏移
@@ -46,22 +73,72 @@ def create_curved_box_mask(shape, p1, p2,
     rot = np.array([[ np.cos(theta), -np.sin(theta)],
                     [ np.sin(theta),  np.cos(theta)]])
 
-    for z, y, x in curve_points:
-        if not (0 <= z < shape[0] and 0 <= y < shape[1] and 0 <= x < shape[2]):
-            continue
-
-        for dz in range(-half_size_z, half_size_z+1):
-            zz = z + dz
-            if not (0 <= zz < shape[0]):
-                continue
-            for dy in range(-half_size_y, half_size_y+1):
-                for dx in range(-half_size_x, half_size_x+1):
-                    vec = np.dot(rot, np.array([dx, dy]))
-                    yy = int(y + vec[1])
-                    xx = int(x + vec[0])
-                    if (0 <= yy < shape[1]) and (0 <= xx < shape[2]):
-                        mask[zz, yy, xx] = 1
+    # Bounding box of the curve plus the (rotation-safe) box extents
+    margin_xy = int(np.ceil(np.hypot(half_size_x, half_size_y))) + 1
+    margins = np.array([half_size_z, margin_xy, margin_xy])
+    lo = np.maximum(curve_points.min(axis=0) - margins, 0)
+    hi = np.minimum(curve_points.max(axis=0) + margins + 1, np.array(shape))
+    # Hand-typed probe points can lie entirely outside the volume; clamp so
+    # the crop degenerates to empty instead of negative dimensions
+    hi = np.maximum(hi, lo)
+    slices = tuple(slice(int(a), int(b)) for a, b in zip(lo, hi))
+    local_shape = tuple(int(b - a) for a, b in zip(lo, hi))
+
+    mask = np.zeros(local_shape, dtype=np.uint8)
+    if min(local_shape) == 0:
+        return mask, slices
+    curve_points = (curve_points - lo).astype(np.int32)
+
+    # Rotate the (dx, dy) offset grid once into an integer offset table;
+    # both fill paths stamp this table instead of rotating per voxel
+    dz, dy, dx = np.mgrid[-half_size_z:half_size_z+1,
+                          -half_size_y:half_size_y+1,
+                          -half_size_x:half_size_x+1]
+    rotated = rot @ np.stack([dx.ravel(), dy.ravel()])
+    off_x = np.rint(rotated[0]).astype(np.int32)
+    off_y = np.rint(rotated[1]).astype(np.int32)
+    off_z = dz.ravel().astype(np.int32)
+
+    if HAVE_NUMBA:
+        _fill_mask(mask, np.ascontiguousarray(curve_points),
+                   off_x, off_y, off_z)
+        return mask, slices
+
+    # Broadcast curve points against the offset grid and clip out-of-bounds voxels
+    zz = (curve_points[:, 0, None] + off_z[None, :]).ravel()
+    yy = (curve_points[:, 1, None] + off_y[None, :]).ravel()
+    xx = (curve_points[:, 2, None] + off_x[None, :]).ravel()
+
+    valid = ((zz >= 0) & (zz < local_shape[0]) &
+             (yy >= 0) & (yy < local_shape[1]) &
+             (xx >= 0) & (xx < local_shape[2]))
+
+    # Boxes overlap heavily along the curve; deduplicate the flat indices so
+    # each voxel is written at most once
+    flat = np.ravel_multi_index((zz[valid], yy[valid], xx[valid]), local_shape)
+    mask.reshape(-1)[np.unique(flat)] = 1
+
+    return mask, slices
+
+def create_curved_box_mask(shape, p1, p2,
+                           half_size_x=5, half_size_y=2, half_size_z=1,
+                           curve_strength=0, rotate_deg=0):
+    """
+    Generate a flat rectangular cuboid rod with curvature and rotation in IJK index space.
 
+    :param shape: Volume shape (z, y, x)
+    :param p1, p2: IJK voxel coordinates (z, y, x)
+    :param half_size_x: Half-width along the x direction (voxels, longer horizontally)
+    :param half_size_y: Half-width along the y direction (voxels, flatter)
+    :param half_size_z: Half-width along the z direction (voxels, thickness)
+    :param curve_strength: Curvature strength; 0 = straight, >0 = curved inward, <0 = curved outward
+    :param rotate_deg: Rotation angle in the xy plane (degrees, positive = counterclockwise, negative = clockwise)
+    """
+    local, slices = _curved_box_local(shape, p1, p2,
+                                      half_size_x, half_size_y, half_size_z,
+                                      curve_strength, rotate_deg)
+    mask = np.zeros(shape, dtype=np.uint8)
+    mask[slices] = local
     return mask
 
 def repair_rib(input_path, output_dir, p1, p2,
@@ -73,19 +150,29 @@ def repair_rib(input_path, output_dir, p1, p2,
     os.makedirs(output_dir, exist_ok=True)
 
     nii = nib.load(input_path)
-    data = nii.get_fdata().astype(np.uint8)
+    # Read at native dtype; get_fdata() would materialize a float64 volume
+    data = np.asarray(nii.dataobj, dtype=np.uint8)
 
-    box_mask = create_curved_box_mask(data.shape, p1, p2,
+    local, slices = _curved_box_local(data.shape, p1, p2,
                                       half_size_x, half_size_y, half_size_z,
                                       curve_strength, rotate_deg)
 
-    repaired = np.maximum(data, box_mask)
+    # Merge the rod inside its bounding box only; data is our own copy
+    repaired = data
+    np.maximum(repaired[slices], local, out=repaired[slices])
+
+    box_mask = np.zeros(data.shape, dtype=np.uint8)
+    box_mask[slices] = local
 
     repaired_path = os.path.join(output_dir, "repaired_rib.nii.gz")
-    nib.save(nib.Nifti1Image(repaired, nii.affine, nii.header), repaired_path)
+    repaired_img = nib.Nifti1Image(repaired, nii.affine, nii.header)
+    repaired_img.set_data_dtype(np.uint8)
+    nib.save(repaired_img, repaired_path)
 
     box_path = os.path.join(output_dir, "box_mask.nii.gz")
-    nib.save(nib.Nifti1Image(box_mask, nii.affine, nii.header), box_path)
+    box_img = nib.Nifti1Image(box_mask, nii.affine, nii.header)
+    box_img.set_data_dtype(np.uint8)
+    nib.save(box_img, box_path)
 
     print(f"✅ finishde repair\n  Rib: {repaired_path}\n  Box: {box_path}")
 
@@ -8,12 +8,38 @@ into a single pipeline for efficient post-processing of chest segmentations.
 
 import os
 import argparse
+import numpy as np
 import nibabel as nib
 import SimpleITK as sitk
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
 # Import functions from existing modules
 from sternum_noise_reduction import keep_largest_component
-from tubercle_recovery import repair_first_rib
+from tubercle_recovery import repair_first_rib, build_spine_mask
+
+def fast_copy(src, dst):
+    """
+    Copy src to dst using os.copy_file_range when available (in-kernel copy,
+    reflink-capable on Btrfs/XFS), falling back to shutil.copy2.
+    Preserves metadata like copy2.
+    """
+    if hasattr(os, "copy_file_range"):
+        try:
+            size = os.stat(src).st_size
+            with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+                remaining = size
+                while remaining > 0:
+                    copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                    if copied == 0:
+                        break
+                    remaining -= copied
+            import shutil
+            shutil.copystat(src, dst)
+            return dst
+        except OSError:
+            pass  # e.g. cross-device copy not supported; fall back below
+    import shutil
+    return shutil.copy2(src, dst)
 
 def process_sternum(input_path, output_path):
     """
@@ -32,27 +58,29 @@ def process_sternum(input_path, output_path):
     # Keep only largest connected sternum component
     cleaned = keep_largest_component(data)
     
-    # Save cleaned mask
+    # Save cleaned mask as uint8 so gzip compresses 1 byte/voxel
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
     new_img = nib.Nifti1Image(cleaned, affine=img.affine, header=img.header)
+    new_img.set_data_dtype(np.uint8)
     nib.save(new_img, output_path)
     
     print(f"Saved cleaned sternum: {output_path}")
     return output_path
 
-def process_first_rib(ct_path, rib_path, output_path):
+def process_first_rib(ct_img, rib_path, output_path, spine=None):
     """
     Process first rib to recover tubercles.
     
     Args:
-        ct_path: Path to the CT scan
+        ct_img: Loaded CT scan (sitk.Image)
         rib_path: Path to the first rib segmentation
         output_path: Path to save the processed first rib segmentation
+        spine: Precomputed spine mask for this CT (optional)
     """
     print(f"Processing first rib: {rib_path}")
     
     # Call the repair_first_rib function
-    repair_first_rib(sitk.ReadImage(ct_path), rib_path, output_path)
+    repair_first_rib(ct_img, rib_path, output_path, spine=spine)
     
     print(f"Saved repaired first rib: {output_path}")
     return output_path
@@ -77,36 +105,64 @@ def run_pipeline_single_subject(ct_path, segmentation_dir, output_dir):
     else:
         print(f"Warning: Sternum file not found at {sternum_path}")
     
-    # Process first ribs (left and right) and copy all other ribs
+    def _handle_rib(rib_num, rib_filename, rib_path, rib_output):
+        # Special processing for first ribs
+        if rib_num == 1:
+            if ct_img is None:
+                # CT read/spine detection failed above; keep the original rib
+                fast_copy(rib_path, rib_output)
+                print(f"No CT available, copied original first rib: {rib_filename}")
+                return
+            try:
+                process_first_rib(ct_img, rib_path, rib_output, spine=spine_mask)
+                print(f"Processed first rib: {rib_filename}")
+            except Exception as e:
+                print(f"Error processing first rib {rib_filename}: {str(e)}")
+                # If processing fails, still copy the original file
+                fast_copy(rib_path, rib_output)
+                print(f"Copied original first rib: {rib_filename}")
+        else:
+            # For ribs 2-12, just copy the files
+            try:
+                fast_copy(rib_path, rib_output)
+                print(f"Copied rib: {rib_filename}")
+            except Exception as e:
+                print(f"Error copying rib {rib_filename}: {str(e)}")
+
+    # Process first ribs (left and right) and copy all other ribs.
+    # Each rib writes its own output file, so the 24 tasks can run on a
+    # thread pool: the copies are pure I/O and SimpleITK releases the GIL.
+    rib_tasks = []
     for side in ["left", "right"]:
         # Process all ribs (1-12) for each side
         for rib_num in range(1, 13):
             rib_filename = f"rib_{side}_{rib_num}.nii.gz"
             rib_path = os.path.join(segmentation_dir, rib_filename)
-            
+
             if not os.path.exists(rib_path):
                 print(f"Warning: Rib file not found at {rib_path}")
                 continue
-                
+
             rib_output = os.path.join(output_dir, rib_filename)
-            
-            # Special processing for first ribs
-            if rib_num == 1:
-                try:
-                    process_first_rib(ct_path, rib_path, rib_output)
-                    print(f"Processed first rib: {rib_filename}")
-                except Exception as e:
-                    print(f"Error processing first rib {rib_filename}: {str(e)}")
-                    # If processing fails, still copy the original file
-                    shutil.copy2(rib_path, rib_output)
-                    print(f"Copied original first rib: {rib_filename}")
-            else:
-                # For ribs 2-12, just copy the files
-                try:
-                    shutil.copy2(rib_path, rib_output)
-                    print(f"Copied rib: {rib_filename}")
-                except Exception as e:
-                    print(f"Error copying rib {rib_filename}: {str(e)}")
+            rib_tasks.append((rib_num, rib_filename, rib_path, rib_output))
+
+    # Decode the CT and detect the spine once per subject; both first ribs
+    # share them. A failed read must not kill the subject: leave ct_img as
+    # None so the per-rib handler below falls back to copying the first
+    # ribs unmodified, like every other rib.
+    ct_img = None
+    spine_mask = None
+    if any(rib_num == 1 for rib_num, _, _, _ in rib_tasks):
+        try:
+            ct_img = sitk.ReadImage(ct_path)
+            spine_mask = build_spine_mask(ct_img)
+        except Exception as e:
+            print(f"Error loading CT {ct_path}: {str(e)}")
+
+    with ThreadPoolExecutor(max_workers=8) as rib_executor:
+        rib_futures = [rib_executor.submit(_handle_rib, *task) for task in rib_tasks]
+        for future in as_completed(rib_futures):
+            future.result()
     
     # Copy any other segmentation files that might exist
     for filename in os.listdir(segmentation_dir):
@@ -115,7 +171,7 @@ def run_pipeline_single_subject(ct_path, segmentation_dir, output_dir):
             dst_path = os.path.join(output_dir, filename)
             if not os.path.exists(dst_path):  # Skip if already processed
                 try:
-                    shutil.copy2(src_path, dst_path)
+                    fast_copy(src_path, dst_path)
                     print(f"Copied additional file: {filename}")
                 except Exception as e:
                     print(f"Error copying file {filename}: {str(e)}")
@@ -146,43 +202,38 @@ def run_pipeline(ct_root, segmentation_root, output_root):
     
     print(f"Found {len(subjects)} subjects to process.")
     
-    # Process each subject
+    # Process subjects in parallel; each one is independent (own CT + niftis)
     successful = 0
     failed = 0
-    
-    for i, subject in enumerate(subjects):
-        print(f"\n[{i+1}/{len(subjects)}] Processing subject: {subject}")
-        
-        # Find CT scan for this subject
-        # ct_path = None
-        # for ct_file in os.listdir(os.path.join(ct_root, subject + "_resampled.nii.gz")):
-        #     if ct_file.endswith(".nii.gz") and not any(x in ct_file for x in ["seg", "label", "mask"]):
-        #         ct_path = os.path.join(ct_root, subject, ct_file)
-        #         break
-        ct_path = os.path.join(ct_root, subject + "_resampled.nii.gz")
-        
-        if not ct_path:
-            print(f"Warning: No CT scan found for subject {subject}, skipping...")
-            failed += 1
-            continue
-        
-        # Set up paths
-        segmentation_dir = os.path.join(segmentation_root, subject)
-        output_dir = os.path.join(output_root, subject)
-        
-        try:
-            # Process this subject
-            success = run_pipeline_single_subject(ct_path, segmentation_dir, output_dir)
-            if success:
-                successful += 1
-                print(f"✅ Successfully processed subject {subject}")
-            else:
+    max_workers = max(1, int(os.cpu_count() * 0.7))
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for subject in subjects:
+            # Find CT scan for this subject
+            ct_path = os.path.join(ct_root, subject + "_resampled.nii.gz")
+
+            # Set up paths
+            segmentation_dir = os.path.join(segmentation_root, subject)
+            output_dir = os.path.join(output_root, subject)
+
+            future = executor.submit(run_pipeline_single_subject, ct_path, segmentation_dir, output_dir)
+            futures[future] = subject
+
+        for i, future in enumerate(as_completed(futures)):
+            subject = futures[future]
+            try:
+                success = future.result()
+                if success:
+                    successful += 1
+                    print(f"[{i+1}/{len(subjects)}] ✅ Successfully processed subject {subject}")
+                else:
+                    failed += 1
+                    print(f"[{i+1}/{len(subjects)}] ❌ Failed to process subject {subject}")
+            except Exception as e:
                 failed += 1
-                print(f"❌ Failed to process subject {subject}")
-        except Exception as e:
-            failed += 1
-            print(f"❌ Error processing subject {subject}: {str(e)}")
-    
+                print(f"[{i+1}/{len(subjects)}] ❌ Error processing subject {subject}: {str(e)}")
+
     print(f"\nPipeline completed: {successful} subjects processed successfully, {failed} failed.")
 
 def main():
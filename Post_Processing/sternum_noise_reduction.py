@@ -3,6 +3,104 @@ import nibabel as nib
 import numpy as np
 from scipy import ndimage
 
+# cc3d (connected-components-3d) is a faster union-find labeler; optional
+try:
+    import cc3d
+    HAVE_CC3D = True
+except ImportError:
+    HAVE_CC3D = False
+
+try:
+    from numba import njit, prange
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
+
+if HAVE_NUMBA:
+    @njit(cache=True)
+    def _find(parent, i):
+        # Path-halving find
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    @njit(cache=True)
+    def _union(parent, a, b):
+        ra = _find(parent, a)
+        rb = _find(parent, b)
+        if ra < rb:
+            parent[rb] = ra
+        elif rb < ra:
+            parent[ra] = rb
+
+    @njit(parallel=True, cache=True)
+    def _label_6(mask):
+        """
+        Two-pass parallel union-find labeling, 6-connectivity.
+        In-slab unions run in parallel over z-slabs (each slab only touches
+        its own voxel ids), then slab boundaries are merged serially.
+        Returns (labels, num_features).
+        """
+        nz, ny, nx = mask.shape
+        n = mask.size
+        flat = mask.reshape(n)
+        parent = np.arange(n, dtype=np.int32)
+
+        nslabs = min(nz, 32)
+        slab = (nz + nslabs - 1) // nslabs
+
+        for s in prange(nslabs):
+            z0 = s * slab
+            z1 = min(z0 + slab, nz)
+            for z in range(z0, z1):
+                for y in range(ny):
+                    base = (z * ny + y) * nx
+                    for x in range(nx):
+                        i = base + x
+                        if flat[i] == 0:
+                            continue
+                        if x > 0 and flat[i - 1]:
+                            _union(parent, i, i - 1)
+                        if y > 0 and flat[i - nx]:
+                            _union(parent, i, i - nx)
+                        if z > z0 and flat[i - ny * nx]:
+                            _union(parent, i, i - ny * nx)
+
+        # Merge components across slab boundaries
+        for s in range(1, nslabs):
+            z = s * slab
+            if z >= nz:
+                break
+            for y in range(ny):
+                base = (z * ny + y) * nx
+                for x in range(nx):
+                    i = base + x
+                    if flat[i] and flat[i - ny * nx]:
+                        _union(parent, i, i - ny * nx)
+
+        # Full path compression so every voxel points at its root. This
+        # loop stays serial: calling _find inside a prange body trips
+        # numba's parfor lowering (the reduction analysis types the index
+        # as float64). The serial pass is cheap next to the union passes.
+        for i in range(n):
+            if flat[i]:
+                parent[i] = _find(parent, i)
+
+        # Assign compact labels at the roots, then propagate
+        labels = np.zeros(n, dtype=np.int32)
+        count = 0
+        for i in range(n):
+            if flat[i] and parent[i] == i:
+                count += 1
+                labels[i] = count
+        for i in prange(n):
+            if flat[i]:
+                labels[i] = labels[parent[i]]
+
+        return labels.reshape(mask.shape), count
+
 def keep_largest_component(data):
     """
     Keep only the largest connected component in a binary segmentation.
@@ -11,22 +109,29 @@ def keep_largest_component(data):
     # Convert to binary mask
     mask = (data > 0).astype(np.uint8)
 
-    # Label connected components
-    labeled, num_features = ndimage.label(mask)
+    # Label connected components (6-connectivity in all backends)
+    if HAVE_CC3D:
+        labeled, num_features = cc3d.connected_components(mask, connectivity=6,
+                                                          return_N=True)
+    elif HAVE_NUMBA:
+        labeled, num_features = _label_6(np.ascontiguousarray(mask))
+    else:
+        structure = ndimage.generate_binary_structure(3, 1)
+        labeled, num_features = ndimage.label(mask, structure=structure)
 
     if num_features == 0:
         return np.zeros_like(data)
 
-    # Get sizes of components
-    sizes = ndimage.sum(mask, labeled, range(1, num_features + 1))
-
-    # Largest component index
-    largest_idx = (np.argmax(sizes) + 1)
-
-    # Keep only the largest
-    largest_component = (labeled == largest_idx).astype(np.uint8)
+    # Component sizes in one C pass; ignore background
+    counts = np.bincount(labeled.ravel())
+    counts[0] = 0
+    largest_idx = counts.argmax()
 
-    return largest_component
+    # Keep only the largest: single-gather lookup table instead of a
+    # full-volume compare followed by an astype copy
+    lut = np.zeros(num_features + 1, dtype=np.uint8)
+    lut[largest_idx] = 1
+    return lut[labeled]
 
 
 # Input/output folders
@@ -44,13 +149,15 @@ for subject in os.listdir(input_folder):
             continue
 
         img = nib.load(filepath)
-        data = img.get_fdata()
+        # Read at native dtype; get_fdata() would materialize a float64 volume
+        data = np.asarray(img.dataobj, dtype=np.uint8)
 
         # Keep only largest connected sternum component
         cleaned = keep_largest_component(data)
 
-        # Save cleaned mask
+        # Save cleaned mask as uint8 so gzip compresses 1 byte/voxel
         new_img = nib.Nifti1Image(cleaned, affine=img.affine, header=img.header)
+        new_img.set_data_dtype(np.uint8)
         outpath = os.path.join(output_folder, f"{file.replace('.nii.gz','')}_processed.nii.gz")
         nib.save(new_img, outpath)
 
@@ -1,8 +1,66 @@
 import os
 import re
+import threading
 import numpy as np
 import SimpleITK as sitk
-from scipy.ndimage import convolve
+from scipy import ndimage
+
+# cc3d's union-find labeler beats scipy.ndimage.label on large volumes; optional
+try:
+    import cc3d
+    HAVE_CC3D = True
+except ImportError:
+    HAVE_CC3D = False
+
+try:
+    from numba import njit, prange
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
+# fastmorph: multithreaded C++ morphology; sitk closing is the fallback
+try:
+    import fastmorph
+    HAVE_FASTMORPH = True
+except ImportError:
+    HAVE_FASTMORPH = False
+
+
+if HAVE_NUMBA:
+    @njit(parallel=True, cache=True)
+    def _endpoint_rows(sk, zyx):
+        """For each skeleton voxel, mark it if its 3x3x3 sum is exactly 2."""
+        keep = np.zeros(zyx.shape[0], dtype=np.bool_)
+        for k in prange(zyx.shape[0]):
+            z, y, x = zyx[k, 0], zyx[k, 1], zyx[k, 2]
+            s = 0
+            for zz in range(max(z - 1, 0), min(z + 2, sk.shape[0])):
+                for yy in range(max(y - 1, 0), min(y + 2, sk.shape[1])):
+                    for xx in range(max(x - 1, 0), min(x + 2, sk.shape[2])):
+                        s += sk[zz, yy, xx]
+            keep[k] = (s == 2)
+        return keep
+else:
+    def _endpoint_rows(sk, zyx):
+        keep = np.zeros(zyx.shape[0], dtype=bool)
+        for k, (z, y, x) in enumerate(zyx):
+            nb = sk[max(z - 1, 0):z + 2, max(y - 1, 0):y + 2, max(x - 1, 0):x + 2]
+            keep[k] = (nb.sum() == 2)
+        return keep
+
+# Reuse filter objects across calls instead of re-instantiating them per rib;
+# kept thread-local because ribcage_pipeline runs rib tasks on a thread pool.
+_filters = threading.local()
+
+def _resampler():
+    if not hasattr(_filters, "resampler"):
+        _filters.resampler = sitk.ResampleImageFilter()
+    return _filters.resampler
+
+def _label_shape_stats():
+    if not hasattr(_filters, "label_shape_stats"):
+        _filters.label_shape_stats = sitk.LabelShapeStatisticsImageFilter()
+    return _filters.label_shape_stats
 
 # -------------------- knobs (tuned for robust recovery / NO OVERSEGMENTATION) --------------------
 UPPER_HU = 1200.0
@@ -34,6 +92,24 @@ FINAL_CLOSING        = (8, 0, 8)  # voxel radii (x,y,z)
 
 # -------------------- helpers --------------------
 def read_img(p): return sitk.ReadImage(p)
+
+def read_ct_fast(p):
+    """
+    Load a CT through nibabel (much faster .nii.gz decode than SimpleITK)
+    and wrap it as a sitk.Image with the full geometry carried over.
+    """
+    import nibabel as nib
+    nii = nib.load(p)
+    data = np.asanyarray(nii.dataobj).astype(np.float32)
+    img = sitk.GetImageFromArray(np.transpose(data, (2, 1, 0)))
+
+    zooms = np.asarray(nii.header.get_zooms()[:3], dtype=float)
+    # nibabel affines are RAS; ITK works in LPS
+    lps = np.diag([-1.0, -1.0, 1.0]) @ nii.affine[:3, :]
+    img.SetSpacing(tuple(zooms))
+    img.SetOrigin(tuple(lps[:, 3]))
+    img.SetDirection(tuple((lps[:, :3] / zooms).ravel()))
+    return img
 def write_img(img, p):
     os.makedirs(os.path.dirname(p), exist_ok=True)
     sitk.WriteImage(img, p)
@@ -41,9 +117,18 @@ def write_img(img, p):
 def to_u8(img): return sitk.Cast(img>0, sitk.sitkUInt8)
 def to_f32(img): return sitk.Cast(img, sitk.sitkFloat32)
 def arr(img): return sitk.GetArrayFromImage(img)
+# Zero-copy, read-only view; use instead of arr() wherever the caller only reads
+def view(img): return sitk.GetArrayViewFromImage(img)
 
 def resample_like(moving, fixed, interp=sitk.sitkNearestNeighbor):
-    R = sitk.ResampleImageFilter()
+    # TotalSegmentator outputs usually share the CT grid exactly; skip the
+    # full resample when the geometries already match
+    if (moving.GetSize() == fixed.GetSize()
+            and moving.GetSpacing() == fixed.GetSpacing()
+            and moving.GetOrigin() == fixed.GetOrigin()
+            and moving.GetDirection() == fixed.GetDirection()):
+        return moving
+    R = _resampler()
     R.SetReferenceImage(fixed)
     R.SetInterpolator(interp)
     R.SetTransform(sitk.Transform())
@@ -58,16 +143,19 @@ def skeleton(bin_u8): return sitk.BinaryThinning(bin_u8)
 
 def endpoints_from_skeleton(skel_u8):
     """Return endpoints as physical points."""
-    sk = arr(skel_u8).astype(np.uint8)           # (z,y,x)
-    nb = convolve(sk, np.ones((3,3,3), dtype=np.uint8), mode="constant", cval=0)
-    ep = (sk == 1) & (nb == 2)                   # voxel + exactly one neighbor
-    zyx = np.argwhere(ep)
+    sk = view(skel_u8).astype(np.uint8)          # (z,y,x)
+    # Skeletons are extremely sparse; count neighbors only at skeleton voxels
+    # instead of convolving the whole volume
+    zyx = np.argwhere(sk)
+    if zyx.size == 0:
+        return []
+    keep = _endpoint_rows(sk, zyx)               # voxel + exactly one neighbor
     to_phys = lambda z,y,x: skel_u8.TransformIndexToPhysicalPoint((int(x), int(y), int(z)))
-    return [to_phys(*p) for p in zyx]
+    return [to_phys(*p) for p in zyx[keep]]
 
 def stats_percentiles_in_mask(ct, mask_u8, pcts=(20, 40)):
-    m = arr(mask_u8)>0
-    hu = arr(ct)[m]
+    m = view(mask_u8)>0
+    hu = view(ct)[m]
     if hu.size == 0:
         return [300.0 for _ in pcts]
     return [float(np.percentile(hu, p)) for p in pcts]
@@ -77,23 +165,50 @@ def build_spine_mask(ct):
     sp = ct.GetSpacing(); origin = ct.GetOrigin(); size = ct.GetSize()
     mid_x_phys = origin[0] + sp[0]*(size[0]/2.0)
     high = to_u8(ct >= SPINE_HU)
-    if not arr(high).any():
+    high_arr = view(high)
+    if not high_arr.any():
         out = sitk.Image(ct.GetSize(), sitk.sitkUInt8); out.CopyInformation(ct); return out
-    cc = sitk.ConnectedComponent(high)
-    ls = sitk.LabelShapeStatisticsImageFilter(); ls.Execute(cc)
-    out = sitk.Image(ct.GetSize(), sitk.sitkUInt8); out.CopyInformation(ct)
-    for L in ls.GetLabels():
-        cx, cy, cz = ls.GetCentroid(L)
-        x,y,z,sx,sy,sz = ls.GetBoundingBox(L)
-        z_extent_mm = sz*sp[2]
-        if abs(cx - mid_x_phys) <= SPINE_MID_TOL_MM and z_extent_mm >= SPINE_Z_EXT_MM:
-            out = sitk.Or(out, to_u8(sitk.BinaryThreshold(cc, L, L, 1, 0)))
-    return sitk.BinaryDilate(out, (1,1,1)) if arr(out).any() else out
-
-def endpoint_is_posterior_missing_tubercle(ct, ribs_u8, ep_phys, nbhd_mm, bone_hu, y_frac_min, x_tol_mm):
+    if HAVE_CC3D:
+        # All-label centroids/bboxes in one C pass instead of a SWIG call
+        # pair per label (hundreds of high-HU components on some CTs)
+        cc_arr, n = cc3d.connected_components(high_arr, connectivity=6,
+                                              return_N=True, binary_image=True)
+        stats = cc3d.statistics(cc_arr)
+        cent = stats["centroids"]                # (n+1, 3) voxel zyx, row 0 = bg
+        cx_phys = origin[0] + sp[0] * cent[:, 2] # same midline math as below
+        z_ext_mm = np.array(
+            [(bb[0].stop - bb[0].start) if bb is not None else 0
+             for bb in stats["bounding_boxes"]], dtype=float) * sp[2]
+        ok = (np.abs(cx_phys - mid_x_phys) <= SPINE_MID_TOL_MM) & \
+             (z_ext_mm >= SPINE_Z_EXT_MM)
+        ok[0] = False
+        kept = np.nonzero(ok)[0].astype(cc_arr.dtype)
+    else:
+        cc = sitk.ConnectedComponent(high)
+        ls = _label_shape_stats(); ls.Execute(cc)
+        kept = []
+        for L in ls.GetLabels():
+            cx, cy, cz = ls.GetCentroid(L)
+            x,y,z,sx,sy,sz = ls.GetBoundingBox(L)
+            z_extent_mm = sz*sp[2]
+            if abs(cx - mid_x_phys) <= SPINE_MID_TOL_MM and z_extent_mm >= SPINE_Z_EXT_MM:
+                kept.append(L)
+        cc_arr = sitk.GetArrayViewFromImage(cc)
+        kept = np.asarray(kept, dtype=cc_arr.dtype)
+    if kept.size == 0:
+        out = sitk.Image(ct.GetSize(), sitk.sitkUInt8); out.CopyInformation(ct)
+        return out
+    # One vectorized membership pass instead of a BinaryThreshold+Or per label
+    mask = np.isin(cc_arr, kept).astype(np.uint8)
+    out = sitk.GetImageFromArray(mask); out.CopyInformation(ct)
+    return sitk.BinaryDilate(out, (1,1,1))
+
+def endpoint_is_posterior_missing_tubercle(ct, ct_a, rib_a, ep_phys, nbhd_mm, bone_hu, y_frac_min, x_tol_mm):
     """
     Returns the fraction of 'other bone' (dense non-rib bone) in the neighborhood.
     Returns 1.0 if not anatomically posterior/midline (no growth needed).
+    ct_a / rib_a are the (z,y,x) arrays of ct and the rib mask, hoisted by
+    the caller so the full volumes are not re-fetched per endpoint.
     """
     sp = ct.GetSpacing()
     idx = ct.TransformPhysicalPointToIndex(ep_phys)
@@ -116,24 +231,44 @@ def endpoint_is_posterior_missing_tubercle(ct, ribs_u8, ep_phys, nbhd_mm, bone_h
     x0,x1 = max(0, idx[0]-rx), min(X-1, idx[0]+rx)
     y0,y1 = max(0, idx[1]-ry), min(Y-1, idx[1]+ry)
     z0,z1 = max(0, idx[2]-rz), min(Z-1, idx[2]+rz)
-    ct_a  = arr(ct); rib_a = arr(ribs_u8)
     roi_ct  = ct_a[z0:z1+1, y0:y1+1, x0:x1+1]
     roi_rib = rib_a[z0:z1+1, y0:y1+1, x0:x1+1]
     
-    other_bone = (roi_ct >= bone_hu) & (roi_rib == 0)
-
-    return other_bone.mean()
+    # count_nonzero over the fused predicate; .mean() would allocate the bool
+    # temp and then run a second reduction pass over it
+    return np.count_nonzero((roi_ct >= bone_hu) & (roi_rib == 0)) / float(roi_ct.size)
 
 def corridor_for_tip(ribs_u8, spine_u8, ep_phys, r_rib_mm, r_tip_mm, ct=None):
-    """Corridor = near-rib band ∩ endpoint sphere ∩ spine-clearance."""
-    d_rib = dist_map_mm(ribs_u8)
+    """
+    Corridor = near-rib band ∩ endpoint sphere ∩ spine-clearance.
+    Everything is computed on a crop around the endpoint (the sphere bounds
+    the corridor anyway) and pasted back, so the distance maps run on a few
+    cm³ instead of the whole CT.
+    """
+    size = ribs_u8.GetSize()
+    sp = ribs_u8.GetSpacing()
+    center_idx = ribs_u8.TransformPhysicalPointToIndex(ep_phys)
+
+    full = sitk.Image(size, sitk.sitkUInt8); full.CopyInformation(ribs_u8)
+
+    # ROI radius: sphere plus whichever of the rib band / spine clearance
+    # needs to see structures beyond the sphere
+    roi_mm = r_tip_mm + max(r_rib_mm, SPINE_CLEAR_MM)
+    rad_roi = [int(round(roi_mm / sp[d])) + 1 for d in range(3)]
+    lo = [max(0, center_idx[d] - rad_roi[d]) for d in range(3)]
+    hi = [min(size[d], center_idx[d] + rad_roi[d] + 1) for d in range(3)]
+    roi_size = [hi[d] - lo[d] for d in range(3)]
+    if min(roi_size) <= 0:
+        return full  # endpoint fell outside the volume
+
+    ribs_roi = sitk.RegionOfInterest(ribs_u8, roi_size, lo)
+    d_rib = dist_map_mm(ribs_roi)
     near_rib = to_u8(d_rib <= r_rib_mm)
 
-    center_idx = ribs_u8.TransformPhysicalPointToIndex(ep_phys)
-    sphere = sitk.Image(ribs_u8.GetSize(), sitk.sitkUInt8); sphere.CopyInformation(ribs_u8)
-    if all(0 <= i < s for i,s in zip(center_idx, ribs_u8.GetSize())):
-        sphere[center_idx] = 1
-    sp = ribs_u8.GetSpacing()
+    sphere = sitk.Image(roi_size, sitk.sitkUInt8); sphere.CopyInformation(ribs_roi)
+    local_idx = tuple(center_idx[d] - lo[d] for d in range(3))
+    if all(0 <= i < s for i, s in zip(local_idx, roi_size)):
+        sphere[local_idx] = 1
     rad = (max(1,int(round(r_tip_mm/sp[0]))),
            max(1,int(round(r_tip_mm/sp[1]))),
            max(1,int(round(r_tip_mm/sp[2]))))
@@ -141,41 +276,85 @@ def corridor_for_tip(ribs_u8, spine_u8, ep_phys, r_rib_mm, r_tip_mm, ct=None):
 
     cor = sitk.And(near_rib, sphere)
 
-    if arr(spine_u8).any():
-        d_spine = dist_map_mm(spine_u8)
+    spine_roi = sitk.RegionOfInterest(spine_u8, roi_size, lo)
+    if sitk.GetArrayViewFromImage(spine_roi).any():
+        d_spine = dist_map_mm(spine_roi)
         spine_clear = to_u8(d_spine >= SPINE_CLEAR_MM)
         cor = sitk.And(cor, spine_clear)
 
-    return cor
+    return sitk.Paste(full, cor, cor.GetSize(), [0, 0, 0], lo)
 
 def region_grow_local(ct, seeds_phys, lo, hi, corridor_u8):
-    """ConnectedThreshold inside corridor only."""
+    """
+    ConnectedThreshold inside corridor only. The grow cannot leave the
+    corridor, so everything runs on the corridor's bounding box and the
+    result is pasted back into an empty full-size image.
+    """
+    empty = sitk.Image(ct.GetSize(), sitk.sitkUInt8); empty.CopyInformation(ct)
     if not seeds_phys:
-        empty = sitk.Image(ct.GetSize(), sitk.sitkUInt8); empty.CopyInformation(ct); return empty
-    ct_masked = sitk.Mask(ct, corridor_u8, outsideValue=-2000.0)
-    seed_idx = [ct.TransformPhysicalPointToIndex(p) for p in seeds_phys]
+        return empty
+    cor_arr = sitk.GetArrayViewFromImage(corridor_u8)
+    nz = np.argwhere(cor_arr)
+    if nz.size == 0:
+        return empty
+    lo_zyx = np.maximum(nz.min(axis=0) - 1, 0)
+    hi_zyx = np.minimum(nz.max(axis=0) + 2, cor_arr.shape)
+    # numpy is (z,y,x); sitk RegionOfInterest wants (x,y,z)
+    index = [int(i) for i in lo_zyx[::-1]]
+    size = [int(b - a) for a, b in zip(lo_zyx[::-1], hi_zyx[::-1])]
+
+    ct_roi = sitk.RegionOfInterest(ct, size, index)
+    cor_roi = sitk.RegionOfInterest(corridor_u8, size, index)
+    ct_masked = sitk.Mask(ct_roi, cor_roi, outsideValue=-2000.0)
+
+    seed_idx = []
+    for p in seeds_phys:
+        gi = ct.TransformPhysicalPointToIndex(p)
+        li = tuple(gi[d] - index[d] for d in range(3))
+        if all(0 <= li[d] < size[d] for d in range(3)):
+            seed_idx.append(li)
+    if not seed_idx:
+        return empty
     rg = sitk.ConnectedThreshold(ct_masked, seedList=seed_idx, lower=lo, upper=hi)
-    return to_u8(rg)
+    return sitk.Paste(empty, to_u8(rg), size, [0, 0, 0], index)
 
 def keep_growth_touching_rib(grow_u8, rib_u8):
     """Keep only grown components that touch the rib (1-voxel dilated)."""
-    if not arr(grow_u8).any():
+    grow_arr = sitk.GetArrayViewFromImage(grow_u8)
+    if not grow_arr.any():
         return grow_u8
-    rib_d = sitk.BinaryDilate(rib_u8, (1,1,1))
-    cc = sitk.ConnectedComponent(grow_u8)
-    ls = sitk.LabelShapeStatisticsImageFilter(); ls.Execute(cc)
-    out = sitk.Image(grow_u8.GetSize(), sitk.sitkUInt8); out.CopyInformation(grow_u8)
-    for L in ls.GetLabels():
-        comp = to_u8(sitk.BinaryThreshold(cc, L, L, 1, 0))
-        if arr(sitk.And(comp, rib_d)).any():
-            out = sitk.Or(out, comp)
+    # Radius-1 ball dilation (the BinaryDilate baseline) == maximum filter
+    # with the 6-neighbor cross, done directly on the array without a sitk
+    # round-trip
+    rib_arr = sitk.GetArrayViewFromImage(rib_u8)
+    rib_d_arr = ndimage.maximum_filter(
+        rib_arr, footprint=ndimage.generate_binary_structure(3, 1),
+        mode='constant')
+
+    # Label once, find the labels under the dilated rib in a single pass,
+    # and rebuild the kept components with isin — no per-label volume passes
+    # Connectivity 6 matches sitk.ConnectedComponent's default, so the touch
+    # filter keeps exactly the components the baseline kept
+    if HAVE_CC3D:
+        labels = cc3d.connected_components(grow_arr, connectivity=6,
+                                           binary_image=True)
+    else:
+        labels, _ = ndimage.label(grow_arr,
+                                  structure=ndimage.generate_binary_structure(3, 1))
+    touching = np.unique(labels[rib_d_arr > 0])
+    touching = touching[touching != 0]
+
+    out_arr = np.isin(labels, touching).astype(np.uint8)
+    out = sitk.GetImageFromArray(out_arr)
+    out.CopyInformation(grow_u8)
     return out
 
 # Implements side-specific hard-cutoff and stricter HU floor strategy
-def repair_first_rib(ct, rib_path, out_path):
+def repair_first_rib(ct, rib_path, out_path, spine=None):
     rib_raw = read_img(rib_path)
     rib = to_u8(resample_like(to_u8(rib_raw), ct))
-    spine = build_spine_mask(ct)
+    if spine is None:
+        spine = build_spine_mask(ct)
 
     rib_filename = os.path.basename(rib_path)
     
@@ -196,12 +375,17 @@ def repair_first_rib(ct, rib_path, out_path):
 
     skel = skeleton(rib)
     endpoints = endpoints_from_skeleton(skel)
-    
+
+    # Zero-copy views, fetched once for all endpoints; force C-contiguity so
+    # the per-endpoint ROI slices stay plain strided views
+    ct_arr = np.ascontiguousarray(sitk.GetArrayViewFromImage(ct))
+    rib_arr = np.ascontiguousarray(sitk.GetArrayViewFromImage(rib))
+
     growth_candidates = []
     for ep in endpoints:
         # Pass required anatomical parameters
         frac = endpoint_is_posterior_missing_tubercle(
-            ct, rib, ep, NBHD_RADIUS_MM, NBHD_BONE_HU, 
+            ct, ct_arr, rib_arr, ep, NBHD_RADIUS_MM, NBHD_BONE_HU, 
             POSTERIOR_Y_IDX_MIN_FRAC, MIDLINE_X_TOL_MM
         )
         
@@ -219,7 +403,9 @@ def repair_first_rib(ct, rib_path, out_path):
         write_img(rib_raw, out_path) 
         return
 
-    grow_union = sitk.Image(ct.GetSize(), sitk.sitkUInt8); grow_union.CopyInformation(ct)
+    # Accumulate growth in one preallocated array; chaining sitk.Or would
+    # allocate a fresh full-volume image per endpoint
+    union_arr = np.zeros(sitk.GetArrayViewFromImage(ct).shape, dtype=np.uint8)
 
     pctl_val, _ = stats_percentiles_in_mask(ct, rib, (PCTL_ROBUST, 0))
     
@@ -233,12 +419,28 @@ def repair_first_rib(ct, rib_path, out_path):
         growth   = region_grow_local(ct, [ep], lower_hu, UPPER_HU, corridor)
         growth   = keep_growth_touching_rib(growth, rib)
 
-        grow_union = sitk.Or(grow_union, growth)
+        np.bitwise_or(union_arr, sitk.GetArrayViewFromImage(growth), out=union_arr)
 
+    grow_union = sitk.GetImageFromArray(union_arr)
+    grow_union.CopyInformation(ct)
     pre = sitk.Or(rib, grow_union)
 
-    # Refine (small, anisotropic closing) and write single output
-    refined = sitk.BinaryMorphologicalClosing(pre, FINAL_CLOSING)
+    # Refine (small, anisotropic closing) and write single output.
+    # fastmorph's element is a sphere, so it only stands in when the radii
+    # are isotropic and non-zero; FINAL_CLOSING deliberately zeroes the y
+    # axis (no-oversegmentation knob), and closing along it anyway would
+    # change output, so that case stays on the sitk filter.
+    if HAVE_FASTMORPH and min(FINAL_CLOSING) > 0 and len(set(FINAL_CLOSING)) == 1:
+        # Multithreaded closing on the array; anisotropy is (z,y,x) spacing
+        closed = fastmorph.spherical_close(
+            sitk.GetArrayViewFromImage(pre).astype(np.uint8),
+            radius=FINAL_CLOSING[0] * ct.GetSpacing()[0],
+            parallel=os.cpu_count(),
+            anisotropy=tuple(ct.GetSpacing()[::-1]))
+        refined = sitk.GetImageFromArray(closed.astype(np.uint8))
+        refined.CopyInformation(ct)
+    else:
+        refined = sitk.BinaryMorphologicalClosing(pre, FINAL_CLOSING)
     # Resample back to original rib space
     refined_out = resample_like(refined, rib_raw)
     write_img(refined_out, out_path)
@@ -265,8 +467,30 @@ def list_first_ribs(ribs_dir: str):
     return hits
 
 # -------------------------- Driver ---------------------------
+def process_subject(args):
+    """Worker: repair both first ribs of one subject (CT read once)."""
+    subj, ct_path, rib_files, out_dir = args
+    print(f"\n===== Processing subject: {subj} =====")
+    try:
+        ct = read_ct_fast(ct_path)
+    except Exception as e:
+        print(f"[ERROR] Could not read CT for {subj}: {e}")
+        return
+
+    # The spine depends only on the CT; detect it once for both first ribs
+    spine = build_spine_mask(ct)
+
+    for rib_path in sorted(rib_files):
+        base = os.path.basename(rib_path).replace(".nii.gz", "").replace(".nii", "")
+        out_path = os.path.join(out_dir, f"{subj}_{base}_postprocessed.nii.gz")
+        try:
+            repair_first_rib(ct, rib_path, out_path, spine=spine)
+        except Exception as e:
+            print(f"[ERROR] {subj}/{base}: {e}")
+
 if __name__ == "__main__":
-    
+    import multiprocessing
+
     base_dir = "/Users/chensirong/TotalSegmentator_postprocessing"
     totalSegmentator_data = os.path.join(base_dir, "TotalSegmentator_Data")
 
@@ -280,8 +504,8 @@ if __name__ == "__main__":
     and d.upper().startswith(SUBJECT_PREFIXES)
     ])
 
+    tasks = []
     for subj in subjects:
-        print(f"\n===== Processing subject: {subj} =====")
         subj_dir = os.path.join(totalSegmentator_data, subj)
         ct_path  = os.path.join(subj_dir, f"{subj}_resampled.nii.gz")
         ribs_dir = os.path.join(subj_dir, f"{subj}_test")
@@ -300,19 +524,12 @@ if __name__ == "__main__":
         else:
             print(f"[INFO] Found ribs: {[os.path.basename(p) for p in rib_files]}")
 
-        # read CT once
-        try:
-            ct = to_f32(read_img(ct_path))
-        except Exception as e:
-            print(f"[ERROR] Could not read CT for {subj}: {e}")
-            continue
+        tasks.append((subj, ct_path, rib_files, out_dir))
 
-        for rib_path in sorted(rib_files):
-            base = os.path.basename(rib_path).replace(".nii.gz", "").replace(".nii", "")
-            out_path = os.path.join(out_dir, f"{subj}_{base}_postprocessed.nii.gz")
-            try:
-                repair_first_rib(ct, rib_path, out_path)
-            except Exception as e:
-                print(f"[ERROR] {subj}/{base}: {e}")
+    # Subjects are independent; run them across half the cores so SimpleITK's
+    # internal threading does not oversubscribe the machine
+    n_workers = max(1, (os.cpu_count() or 2) // 2)
+    with multiprocessing.Pool(processes=n_workers) as pool:
+        pool.map(process_subject, tasks)
 
     print("\n🎉 All subjects processed!")
\ No newline at end of file
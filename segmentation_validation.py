@@ -1,18 +1,50 @@
+import csv
 import os
 import re
 import numpy as np
 import nibabel as nib
-import pandas as pd
 from datetime import datetime
 
+# Optional: a fused Numba kernel counts both masks and their intersection in
+# one streaming pass; the numpy path below is the fallback
+try:
+    from numba import njit, prange
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
+if HAVE_NUMBA:
+    @njit(parallel=True, cache=True)
+    def _dice_kernel(a, b):
+        inter = 0
+        sa = 0
+        sb = 0
+        for i in prange(a.size):
+            ai = a[i]
+            bi = b[i]
+            inter += ai & bi
+            sa += ai
+            sb += bi
+        return inter, sa, sb
+
+def dice_counts(pred, gt):
+    """Return (intersection, |pred|, |gt|) counts for binary masks."""
+    if HAVE_NUMBA:
+        # bool arrays reinterpret as uint8 without a copy
+        a = np.ascontiguousarray(pred).view(np.uint8).ravel()
+        b = np.ascontiguousarray(gt).view(np.uint8).ravel()
+        return _dice_kernel(a, b)
+    inter = np.count_nonzero(pred & gt)
+    p_sum = np.count_nonzero(pred)
+    g_sum = np.count_nonzero(gt)
+    return inter, p_sum, g_sum
+
 def dice_score(pred, gt):
-    """Compute Dice Similarity Coefficient for binary masks."""
-    pred = pred.astype(bool)
-    gt = gt.astype(bool)
-    intersection = np.logical_and(pred, gt).sum()
-    if pred.sum() + gt.sum() == 0:
+    """Compute Dice Similarity Coefficient for binary masks (bool arrays)."""
+    inter, p_sum, g_sum = dice_counts(pred, gt)
+    if p_sum + g_sum == 0:
         return 1.0  # both empty, define as perfect
-    return 2.0 * intersection / (pred.sum() + gt.sum())
+    return 2.0 * inter / (p_sum + g_sum)
 
 def process_case(case_id, gt_root, pred_root):
     """
@@ -29,9 +61,13 @@ def process_case(case_id, gt_root, pred_root):
     print(components)
 
     results = {}
-    overall_gt = None
-    overall_pred = None
-    
+    # Components are disjoint labels, so the overall Dice is just the ratio
+    # of summed counts; no need to OR every mask into overall volumes
+    total_inter = 0
+    total_p = 0
+    total_g = 0
+    n_comps = 0
+
     for comp in components:
         gt_path = os.path.join(gt_case_folder, comp)
         pred_path = os.path.join(pred_case_folder, comp)
@@ -40,20 +76,24 @@ def process_case(case_id, gt_root, pred_root):
             print(f"⚠️ Warning: Missing predicted file {pred_path}, skipping")
             continue
         
-        gt_img = nib.load(gt_path).get_fdata()
-        pred_img = nib.load(pred_path).get_fdata()
+        # Load through dataobj as bool; get_fdata() would allocate float64 volumes
+        gt_img = np.asanyarray(nib.load(gt_path).dataobj, dtype=np.uint8).astype(bool, copy=False)
+        pred_img = np.asanyarray(nib.load(pred_path).dataobj, dtype=np.uint8).astype(bool, copy=False)
         
         comp_name = re.sub(r'\.nii\.gz$', '', comp)
-        score = dice_score(pred_img, gt_img)
+        inter, p_sum, g_sum = dice_counts(pred_img, gt_img)
+        score = 1.0 if p_sum + g_sum == 0 else 2.0 * inter / (p_sum + g_sum)
         results[comp_name] = round(score, 3)  # round to 3 decimals
-        
-        # Build overall masks
-        overall_gt = gt_img.astype(bool) if overall_gt is None else np.logical_or(overall_gt, gt_img)
-        overall_pred = pred_img.astype(bool) if overall_pred is None else np.logical_or(overall_pred, pred_img)
-    
-    # Add overall ribcage Dice
-    if overall_gt is not None and overall_pred is not None:
-        results["Ribcage_Overall"] = round(dice_score(overall_pred, overall_gt), 3)
+
+        total_inter += inter
+        total_p += p_sum
+        total_g += g_sum
+        n_comps += 1
+
+    # Add overall ribcage Dice from the accumulated counts
+    if n_comps > 0:
+        overall = 1.0 if total_p + total_g == 0 else 2.0 * total_inter / (total_p + total_g)
+        results["Ribcage_Overall"] = round(overall, 3)
     else:
         results["Ribcage_Overall"] = np.nan
     
@@ -62,64 +102,45 @@ def process_case(case_id, gt_root, pred_root):
 
 
 def main(gt_root, pred_root, output_csv="segmentation_validation_log.csv"):
-    all_components = set()
-    
-    # First pass: collect all possible component names across cases
-    for case_id in sorted(os.listdir(pred_root)):
-        case_folder = os.path.join(pred_root, case_id)
-        if not os.path.isdir(case_folder):
-            continue
-        for comp in sorted(os.listdir(case_folder)):
-            # Use regex to remove .nii.gz extension
-            comp_name = re.sub(r'\.nii\.gz$', '', comp)
-            all_components.add(comp_name)
-    print("All components:", all_components)
-    all_components.add("Ribcage_Overall")
-    
-    # Define fixed order
+    # Fixed column template: TotalSegmentator output names are stable, so
+    # there is no need for a discovery pass over every case folder (a second
+    # full listdir+stat sweep that dominates on network storage). Cases
+    # missing a component simply leave that cell empty.
     fixed_order = [
         "Ribcage_Overall",
         "sternum",
     ] + [f"rib_left_{i}" for i in range(1, 13)] \
     + [f"rib_right_{i}" for i in range(1, 13)]
 
-    # Now filter to keep only components that actually exist in all_components
-    component_cols = [c for c in fixed_order if c in all_components]
-
     # Final column order
-    cols = ["Timestamp", "Test_Case"] + component_cols
+    cols = ["Timestamp", "Test_Case"] + fixed_order
 
-    # Final summary table
-    summary = []
-    
-    # Create CSV with header if not already present
-    if not os.path.exists(output_csv):
-        pd.DataFrame(columns=cols).to_csv(output_csv, index=False)
-    
-    # Process each case and append immediately
-    for case_id in sorted(os.listdir(pred_root)):
-
-        try:
-            results = process_case(case_id, gt_root, pred_root)
-            results["Timestamp"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            results["Test_Case"] = case_id
-            
-            # Ensure all columns exist, fill missing ones with NaN
-            row = {col: results.get(col, np.nan) for col in cols}
-            
-            # Append row immediately
-            pd.DataFrame([row]).to_csv(output_csv, mode="a", header=False, index=False)
-            summary.append((case_id, row["Ribcage_Overall"]))
-            
-            print(f"✅ Logged {case_id}")
-        except Exception as e:
-            print(f"Skipping {case_id}, error: {e}")
-    
-    # Print summary verdict
-    print("\n========== Overall Ribcage Dice Score Summary ==========")
-    for case_id, score in summary:
-        verdict = "PASS ✅" if (isinstance(score, float) and score >= 0.9) else "FAIL ❌"
-        print(f"{case_id:10s} | {score:.3f} | {verdict}")
+    # Open the log once and stream rows through csv; spinning up a pandas
+    # DataFrame per appended row re-opened the file and re-inferred dtypes
+    # every case
+    write_header = not os.path.exists(output_csv)
+    with open(output_csv, "a", newline="", buffering=1 << 16) as f:
+        writer = csv.DictWriter(f, fieldnames=cols, restval="")
+        if write_header:
+            writer.writeheader()
+
+        # Process each case and append immediately
+        for case_id in sorted(os.listdir(pred_root)):
+
+            try:
+                results = process_case(case_id, gt_root, pred_root)
+                results["Timestamp"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                results["Test_Case"] = case_id
+
+                # Missing columns fall back to restval
+                writer.writerow({col: results[col] for col in cols if col in results})
+
+                # Stream the verdict as we go instead of buffering a summary
+                score = results.get("Ribcage_Overall", np.nan)
+                verdict = "PASS ✅" if (isinstance(score, float) and score >= 0.9) else "FAIL ❌"
+                print(f"✅ Logged {case_id} | {score:.3f} | {verdict}")
+            except Exception as e:
+                print(f"Skipping {case_id}, error: {e}")
 
 if __name__ == "__main__":
     import argparse